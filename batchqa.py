@@ -0,0 +1,487 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from argparse import RawTextHelpFormatter
+
+# Set up and parse command line arguments
+parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter, description='\n'.join([
+    'Runs irdrop.py QA over many libraries at once using a work queue kept in a shared directory.',
+    'Any number of workers on any number of hosts that share the directory can work on the queue.',
+    '',
+    'Manifest format: one input list (like in.txt) per line, optionally followed by a library name.',
+    'Relative paths are taken from the directory of the file they are written in. A library is',
+    'named after the directory of its input list unless the manifest names it.',
+    '',
+    'Examples:',
+    '\t1) Fill the queue from a manifest:',
+    '\t$ python3 batchqa.py submit manifest.txt -q /shared/qa_queue',
+    '',
+    '\t2) Start a worker (run as many as needed, on any host):',
+    '\t$ python3 batchqa.py work -q /shared/qa_queue',
+    '',
+    '\t3) Show progress:',
+    '\t$ python3 batchqa.py status -q /shared/qa_queue'
+]))
+parser.add_argument('command', choices=['submit', 'work', 'status'], help='Action to take on the queue')
+parser.add_argument('manifest', nargs='?', help='Manifest of input lists, used by submit')
+parser.add_argument('-q', '--queue', type=str, default='./qa_queue', help='Shared queue directory')
+parser.add_argument('--heartbeat', type=float, default=10.0, help='Seconds between claim refreshes while a job runs')
+parser.add_argument('--stale', type=float, default=120.0, help='Seconds without a refresh before a claim is taken over')
+parser.add_argument('--max_attempts', type=int, default=3, help='Times a job is tried before it is marked failed')
+parser.add_argument('--poll', type=float, default=2.0, help='Seconds a worker waits when no job is ready')
+args = parser.parse_args()
+
+IRDROP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'irdrop.py')
+
+HOST = socket.gethostname()
+
+# Sub directories of the queue directory
+JOBS_DIRECTORY = 'jobs'       # One json spec per job
+CLAIMS_DIRECTORY = 'claims'   # One lock file per attempt at a job, refreshed by its worker
+FINISHED_DIRECTORY = 'done'   # One json result per job that passed or ran out of attempts
+WORK_DIRECTORY = 'work'       # Per-library input lists, databases and logs
+RESULTS_DIRECTORY = 'results' # One error log per library
+
+################################################################################
+# Queue files
+################################################################################
+def queue_path(*parts):
+    '''
+    Summary: builds a path inside the queue directory
+    Input:
+        parts: path components below the queue directory
+    Returns: path string
+    '''
+    return os.path.join(args.queue, *parts)
+
+def write_json(path, data):
+    '''
+    Summary: writes json so that readers on other hosts never see a half written file
+    Input:
+        path: destination file path
+        data: json serializable object
+    '''
+    temporary_path = '{path}.{host}.{pid}.tmp'.format(path = path, host = HOST, pid = os.getpid())
+    with open(temporary_path, 'w') as f:
+        json.dump(data, f, indent = 2)
+    os.replace(temporary_path, path)
+
+def read_json(path):
+    '''
+    Summary: reads a json file
+    Input:
+        path: file path
+    Returns: parsed json, or None if the file is missing or unreadable
+    '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_jobs():
+    '''
+    Summary: reads every job spec in the queue
+    Returns: list of job dictionaries sorted by job id
+    '''
+    jobs = []
+    for name in sorted(os.listdir(queue_path(JOBS_DIRECTORY))):
+        if name.endswith('.json'):
+            job = read_json(queue_path(JOBS_DIRECTORY, name))
+            if job is not None:
+                jobs.append(job)
+    return jobs
+
+def load_finished():
+    '''
+    Summary: reads the result of every finished job
+    Returns: dictionary in format <job id> : <result dictionary>
+    '''
+    finished = {}
+    for name in os.listdir(queue_path(FINISHED_DIRECTORY)):
+        if name.endswith('.json'):
+            result = read_json(queue_path(FINISHED_DIRECTORY, name))
+            if result is not None:
+                finished[name[:-len('.json')]] = result
+    return finished
+
+def finish(job_id, status, **details):
+    '''
+    Summary: records a job as finished
+    Input:
+        job_id: id of the job
+        status: 'ok' or 'failed'
+        details: extra result fields, ex: attempts, message
+    '''
+    result = {'status': status, 'host': HOST, 'finished': time.time()}
+    result.update(details)
+    write_json(queue_path(FINISHED_DIRECTORY, job_id + '.json'), result)
+
+################################################################################
+# Submitting
+################################################################################
+def add_job(job, claims):
+    '''
+    Summary: writes a job spec to the queue. A job submitted again is run again, so the result
+        and claims of its previous run are removed.
+    Input:
+        job: job dictionary
+        claims: newest attempt at every claimed job, from load_claims
+    '''
+    stale_files = [queue_path(FINISHED_DIRECTORY, job['id'] + '.json')]
+    stale_files += [claim_path(job['id'], attempts) for attempts in range(1, claims.get(job['id'], 0) + 1)]
+    if 'result' in job:
+        stale_files.append(job['result'])
+    for stale_file in stale_files:
+        try:
+            os.remove(stale_file)
+        except FileNotFoundError:
+            pass
+    write_json(queue_path(JOBS_DIRECTORY, job['id'] + '.json'), job)
+
+def submit(manifest):
+    '''
+    Summary: breaks every library in the manifest into one parse job per view file and one QA
+        job that merges the parsed files and runs the checks. Submitting a library again
+        queues all of its jobs again.
+    Input:
+        manifest: path of the manifest file
+    '''
+    for directory in [JOBS_DIRECTORY, CLAIMS_DIRECTORY, FINISHED_DIRECTORY, WORK_DIRECTORY, RESULTS_DIRECTORY]:
+        os.makedirs(queue_path(directory), exist_ok = True)
+
+    with open(manifest) as f:
+        lines = [line.split() for line in f.readlines()]
+    manifest_directory = os.path.dirname(os.path.abspath(manifest))
+    claims = load_claims()
+
+    job_count = 0
+    libraries = set()
+    for words in lines:
+        if len(words) == 0:
+            continue
+        input_list = os.path.join(manifest_directory, words[0])
+        # Input lists are usually named in.txt, so the directory holding one names the library
+        library = words[1] if len(words) > 1 else os.path.basename(os.path.dirname(input_list))
+        # Keep library names unique so their work directories don't collide
+        name = library
+        suffix = 2
+        while name in libraries:
+            name = '{library}_{suffix}'.format(library = library, suffix = suffix)
+            suffix += 1
+        libraries.add(name)
+
+        work_directory = os.path.abspath(queue_path(WORK_DIRECTORY, name))
+        os.makedirs(work_directory, exist_ok = True)
+
+        # Workers run from any directory, so view paths are made absolute. Corner and process
+        # names following a path are kept.
+        input_directory = os.path.dirname(input_list)
+        with open(input_list) as f:
+            view_lines = []
+            for line in f.readlines():
+                view_words = line.split()
+                if len(view_words) > 0:
+                    view_words[0] = os.path.join(input_directory, view_words[0])
+                    view_lines.append(' '.join(view_words))
+        library_list = os.path.join(work_directory, 'in.txt')
+        with open(library_list, 'w') as f:
+            for view_line in view_lines:
+                f.write(view_line + '\n')
+
+        # One parse job per view file, each writing its own database shard
+        parse_job_ids = []
+        shards = []
+        shard_errors = []
+        for index, view_line in enumerate(view_lines):
+            stem = '{index:04d}_{name}'.format(index = index, name = os.path.basename(view_line.split()[0]))
+            shard_list = os.path.join(work_directory, stem + '.txt')
+            with open(shard_list, 'w') as f:
+                f.write(view_line + '\n')
+            shard = os.path.join(work_directory, stem + '.db')
+            shard_error = os.path.join(work_directory, stem + '.log')
+            job_id = '{library}.parse.{index:04d}'.format(library = name, index = index)
+            add_job({
+                'id': job_id,
+                'library': name,
+                'kind': 'parse',
+                'arguments': [shard_list, '-d', shard, '-e', shard_error, '--parse_only'],
+                'depends_on': [],
+                'output': os.path.join(work_directory, stem + '.out'),
+            }, claims)
+            parse_job_ids.append(job_id)
+            shards.append(shard)
+            shard_errors.append(shard_error)
+
+        # One QA job per library, once all its files are parsed
+        qa_error = os.path.join(work_directory, 'qa.log')
+        job_id = '{library}.qa'.format(library = name)
+        add_job({
+            'id': job_id,
+            'library': name,
+            'kind': 'qa',
+            'arguments': [library_list, '-d', os.path.join(work_directory, 'redhawk.db'), '-e', qa_error, '--shards'] + shards,
+            'depends_on': parse_job_ids,
+            'output': os.path.join(work_directory, 'qa.out'),
+            'error_files': shard_errors + [qa_error],
+            'result': os.path.abspath(queue_path(RESULTS_DIRECTORY, name + '.log')),
+        }, claims)
+        job_count += len(parse_job_ids) + 1
+
+    print('Submitted {jobs} jobs for {libraries} libraries to {queue}'.format(
+        jobs = job_count, libraries = len(libraries), queue = args.queue))
+
+################################################################################
+# Working
+################################################################################
+def claim_path(job_id, attempts):
+    '''
+    Summary: builds the path of the lock file of one attempt at a job
+    Input:
+        job_id: id of the job
+        attempts: attempt number
+    Returns: path string
+    '''
+    return queue_path(CLAIMS_DIRECTORY, '{job}.attempt{attempts}.lock'.format(job = job_id, attempts = attempts))
+
+def parse_claim_name(name):
+    '''
+    Summary: splits a lock file name into its job id and attempt number
+    Input:
+        name: file name in the claims directory
+    Returns: (job id, attempt number), or None if the name isn't a lock file
+    '''
+    if not name.endswith('.lock') or '.attempt' not in name:
+        return None
+    job_id, attempts = name[:-len('.lock')].rsplit('.attempt', 1)
+    if not attempts.isdigit():
+        return None
+    return job_id, int(attempts)
+
+def load_claims():
+    '''
+    Summary: finds the newest attempt at every claimed job
+    Returns: dictionary in format <job id> : <attempt number>
+    '''
+    claims = {}
+    for name in os.listdir(queue_path(CLAIMS_DIRECTORY)):
+        claim = parse_claim_name(name)
+        if claim is not None:
+            job_id, attempts = claim
+            claims[job_id] = max(claims.get(job_id, 0), attempts)
+    return claims
+
+def try_claim(job_id, previous_attempts):
+    '''
+    Summary: tries to claim a job. Every attempt has its own lock file, created atomically, so
+        taking over attempt N means creating the lock of attempt N + 1 and only one worker can
+        do that. A claim is taken over once its worker stops refreshing it (crashed or failed).
+    Input:
+        job_id: id of the job
+        previous_attempts: newest attempt at the job found by load_claims, 0 if none
+    Returns: attempt number if the claim succeeded, otherwise None
+    '''
+    if previous_attempts > 0:
+        try:
+            age = time.time() - os.stat(claim_path(job_id, previous_attempts)).st_mtime
+        except FileNotFoundError:
+            # Finished, or taken over between listing and checking
+            return None
+        if age < args.stale:
+            return None
+
+    attempts = previous_attempts + 1
+    if attempts > args.max_attempts:
+        finish(job_id, 'failed', attempts = previous_attempts, message = 'Gave up after {} attempts'.format(previous_attempts))
+        return None
+
+    try:
+        descriptor = os.open(claim_path(job_id, attempts), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    with os.fdopen(descriptor, 'w') as f:
+        json.dump({'host': HOST, 'pid': os.getpid(), 'attempts': attempts, 'claimed': time.time()}, f)
+
+    # The previous attempt's worker notices its lock is gone on its next refresh and stops
+    if previous_attempts > 0:
+        try:
+            os.remove(claim_path(job_id, previous_attempts))
+        except FileNotFoundError:
+            pass
+    return attempts
+
+def owns_claim(job_id, attempts):
+    '''
+    Summary: checks that a claim still belongs to this worker, i.e. its lock file exists, names
+        this host and process, and no later attempt at the job was started
+    Input:
+        job_id: id of the job
+        attempts: attempt number of the claim
+    Returns: True if the claim is still held
+    '''
+    claim = read_json(claim_path(job_id, attempts))
+    if claim is None or claim.get('host') != HOST or claim.get('pid') != os.getpid():
+        return False
+    return load_claims().get(job_id) == attempts
+
+def merge_error_files(error_files, result):
+    '''
+    Summary: combines the error logs of a library's parse and QA jobs into one log
+    Input:
+        error_files: list of error log paths, missing files mean no errors
+        result: path of the combined log
+    Returns: number of errors in the combined log
+    '''
+    messages = []
+    for error_file in error_files:
+        if os.path.isfile(error_file):
+            with open(error_file) as f:
+                messages += [line.rstrip('\n') for line in f if line.strip() != '']
+    messages = list(dict.fromkeys(messages))
+    with open(result, 'w') as f:
+        for message in messages:
+            f.write(message + '\n')
+    return len(messages)
+
+def run_job(job, attempts):
+    '''
+    Summary: runs a claimed job, refreshing its claim until irdrop.py exits. A failed run
+        leaves its claim stale so that any worker retries it.
+    Input:
+        job: job dictionary
+        attempts: attempt number of this run
+    '''
+    lock = claim_path(job['id'], attempts)
+    print('[{host}] Running {job} (attempt {attempts})'.format(host = HOST, job = job['id'], attempts = attempts), flush=True)
+    start_time = time.time()
+
+    with open(job['output'], 'w') as output:
+        process = subprocess.Popen([sys.executable, IRDROP_PATH] + job['arguments'], stdout = output, stderr = subprocess.STDOUT)
+        while process.poll() is None:
+            try:
+                claim_held = owns_claim(job['id'], attempts)
+                if claim_held:
+                    os.utime(lock)
+            except FileNotFoundError:
+                claim_held = False
+            if not claim_held:
+                # Another worker decided this claim was stale and took the job over
+                process.kill()
+                process.wait()
+                print('[{host}] Lost claim on {job}'.format(host = HOST, job = job['id']), flush=True)
+                return
+            try:
+                process.wait(timeout = args.heartbeat)
+            except subprocess.TimeoutExpired:
+                pass
+
+    elapsed = time.time() - start_time
+    if process.returncode != 0:
+        print('[{host}] {job} failed with exit code {code}, see {output}'.format(
+            host = HOST, job = job['id'], code = process.returncode, output = job['output']), flush=True)
+        try:
+            os.utime(lock, (0, 0))
+        except FileNotFoundError:
+            pass
+        return
+
+    if not owns_claim(job['id'], attempts):
+        print('[{host}] Lost claim on {job}, discarding its result'.format(host = HOST, job = job['id']), flush=True)
+        return
+
+    details = {'attempts': attempts, 'seconds': elapsed}
+    if job['kind'] == 'qa':
+        details['errors'] = merge_error_files(job['error_files'], job['result'])
+    finish(job['id'], 'ok', **details)
+    os.remove(lock)
+    print('[{host}] Finished {job} in {seconds:.1f} s'.format(host = HOST, job = job['id'], seconds = elapsed), flush=True)
+
+def work():
+    '''
+    Summary: claims and runs ready jobs until every job in the queue is finished. Parse jobs
+        are ready at once; QA jobs are ready when all their parse jobs passed.
+    '''
+    while True:
+        finished = load_finished()
+        pending = [job for job in load_jobs() if job['id'] not in finished]
+        if len(pending) == 0:
+            break
+        claims = load_claims()
+
+        ran_job = False
+        for job in pending:
+            dependency_status = [finished.get(dependency, {}).get('status') for dependency in job['depends_on']]
+            if 'failed' in dependency_status:
+                finish(job['id'], 'failed', message = 'A file of the library could not be parsed')
+                continue
+            if any(status != 'ok' for status in dependency_status):
+                continue
+
+            attempts = try_claim(job['id'], claims.get(job['id'], 0))
+            if attempts is None:
+                continue
+            run_job(job, attempts)
+            ran_job = True
+            break
+
+        if not ran_job:
+            time.sleep(args.poll)
+
+    print('[{host}] No jobs left'.format(host = HOST), flush=True)
+
+################################################################################
+# Status
+################################################################################
+def status():
+    '''
+    Summary: prints how many jobs are finished, failed, running and waiting, and the error
+        count of every library that finished its QA
+    '''
+    jobs = load_jobs()
+    finished = load_finished()
+    claims = load_claims()
+
+    passed = [job for job in jobs if finished.get(job['id'], {}).get('status') == 'ok']
+    failed = [job for job in jobs if finished.get(job['id'], {}).get('status') == 'failed']
+    running = [job for job in jobs if job['id'] not in finished and job['id'] in claims]
+    waiting = len(jobs) - len(passed) - len(failed) - len(running)
+    print('Jobs: {total} total, {passed} passed, {failed} failed, {running} running, {waiting} waiting'.format(
+        total = len(jobs), passed = len(passed), failed = len(failed), running = len(running), waiting = waiting))
+
+    print('\nLibraries:')
+    for job in jobs:
+        if job['kind'] != 'qa':
+            continue
+        result = finished.get(job['id'])
+        if result is None:
+            print('\t{library}: in progress'.format(library = job['library']))
+        elif result['status'] == 'failed':
+            print('\t{library}: FAILED ({message})'.format(library = job['library'], message = result.get('message', 'see ' + job['output'])))
+        else:
+            print('\t{library}: {errors} errors, see {result}'.format(library = job['library'], errors = result['errors'], result = job['result']))
+
+    for job in failed:
+        if job['kind'] == 'parse':
+            print('\nFailed parse job {job}, see {output}'.format(job = job['id'], output = job['output']))
+
+################################################################################
+# Main script
+################################################################################
+if args.command == 'submit':
+    if args.manifest is None:
+        print('ERROR: submit needs a manifest')
+        sys.exit(1)
+    submit(args.manifest)
+elif not os.path.isdir(queue_path(JOBS_DIRECTORY)):
+    print('ERROR: no queue found at {}'.format(args.queue))
+    sys.exit(1)
+elif args.command == 'work':
+    work()
+else:
+    status()
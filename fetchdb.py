@@ -4,6 +4,7 @@ import argparse
 import sqlite3
 import os, sys
 from argparse import RawTextHelpFormatter
+from querycache import cached_query, DEFAULT_CACHE_BYTES
 
 
 # Set up and parse command line arguments
@@ -11,10 +12,10 @@ parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter, descripti
     'Allows for simple fetch commands straight from the command line to allow users to easily see the data being returned.',
     '',
     'Tables and Columns:',
-    '\t- cdev [cell, temperature, state, vector, active_input, active_output, vpwr, vgnd, pin, esc, esr, leak, filename]',
-    '\t- spiprof [cell, vpwr, c1, r, c2, slew1, slew2, state, vector, active_input, active_output, pin, peak, area, width, filename]',
+    '\t- cdev [cell, temperature, state, vector, active_input, active_output, vpwr, vgnd, pin, esc, esr, leak, filename, corner, process]',
+    '\t- spiprof [cell, vpwr, c1, r, c2, slew1, slew2, state, vector, active_input, active_output, pin, peak, area, width, filename, corner, process]',
     '\t- pgarc [cell, pin]',
-    '\t- lib [cell, area, filename]',
+    '\t- lib [cell, area, filename, corner, process]',
     '',
     'Examples:',
     '\t1) To grab all data pertaining to the cell dffnrq_1x from cdev:',
@@ -24,10 +25,15 @@ parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter, descripti
     '\t$ python3 fetchdb.py "SELECT DISTINCT state FROM spiprof ORDER BY state"',
     '',
     '\t3) To grab the cells with the highest leakage current:',
-    '\t$ python3 fetchdb.py "SELECT DISTINCT cell, leak FROM cdev ORDER BY leak DESC LIMIT 25"'
+    '\t$ python3 fetchdb.py "SELECT DISTINCT cell, leak FROM cdev ORDER BY leak DESC LIMIT 25"',
+    '',
+    'Results of SELECT queries are cached next to the database (<database>.cache) and reused',
+    'until irdrop.py writes to the database again.'
 ]))
 parser.add_argument('query', help='''SQL query to execute''')
 parser.add_argument('-d', '--database', type=str, default='./redhawk.db', help='File path for the database')
+parser.add_argument('--no_cache', default=False, action='store_true', help='Always query the database, skipping the result cache')
+parser.add_argument('--cache_size', type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024), help='Size limit of the result cache in MB')
 args = parser.parse_args()
 
 # Connect to the database
@@ -37,11 +43,15 @@ if not os.path.isfile(args.database):
 connection = sqlite3.connect(args.database)
 
 # Execute SQL fetch
-cursor = connection.execute(args.query)
+if args.no_cache:
+    cursor = connection.execute(args.query)
+    names = [description[0] for description in cursor.description]
+    rows = cursor.fetchall()
+else:
+    names, rows = cached_query(connection, args.database, args.query, max_bytes = args.cache_size * 1024 * 1024)
 
 # Print data
-names = [description[0] for description in cursor.description]
 print('Columns Names:\n{}\n'.format(names))
 print('Data:')
-for row in cursor:
+for row in rows:
     print(row)
@@ -5,16 +5,29 @@ import sqlite3
 import os.path
 import matplotlib.pyplot as plt
 import numpy as np
+from querycache import cached_query
 
 # Set up and parse command line arguments
 parser = argparse.ArgumentParser(description='''Plot IR drop analysis comparing
     the values of .cdev, .spiprof, and .pgarc files''')
 parser.add_argument('-d', '--database', type=str, default='./redhawk.db', help='File path for the database')
+parser.add_argument('--no_cache', default=False, action='store_true', help='Always query the database, skipping the result cache')
 args = parser.parse_args()
 
-def peak_vpwr_vary_state(connection):
-    cursor = connection.cursor()
+def fetch(connection, query):
+    '''
+    Summary: runs a query, reusing the cached result when the database hasn't changed since
+    Input:
+        connection: sqllite connection object
+        query: SQL query string
+    Returns: numpy array of the result rows
+    '''
+    if args.no_cache:
+        return np.array(connection.execute(query).fetchall())
+    names, rows = cached_query(connection, args.database, query)
+    return np.array(rows)
 
+def peak_vpwr_vary_state(connection):
     # Query State, VPWR, and Peak Current for only the first 7 PVT1 sections of dffnrq_1x cell
     data_query = '''SELECT DISTINCT state, vpwr, peak
     FROM spiprof
@@ -25,18 +38,16 @@ def peak_vpwr_vary_state(connection):
     AND c2 = 1.0e-15
     AND slew1 = 1.25e-11
     AND slew2 = 7.5e-12
-    AND filename LIKE '%PVT1%'
+    AND corner = 'PVT1'
     ORDER BY vpwr
     '''
-    cursor.execute(data_query)
-    db_data = np.array(cursor.fetchall())
+    db_data = fetch(connection, data_query)
 
     # Query states from spiprof
     state_query = '''SELECT DISTINCT state
     FROM spiprof
     ORDER BY state'''
-    cursor.execute(state_query)
-    db_states = np.array(cursor.fetchall())
+    db_states = fetch(connection, state_query)
 
     # Extract VPWR and Peak Current for each state
     extracted_data = np.absolute(db_data[:, [1, 2]].astype(float))
@@ -56,18 +67,15 @@ def peak_vpwr_vary_state(connection):
     # plt.show()
 
 def area_vpwr_vary_parameters(connection):
-    cursor = connection.cursor()
-
     # Query c2, slew1, slew2, vpwr, and area for dffnrq_1x cell under PVT1 conditions
     data_query = '''SELECT DISTINCT c2, slew1, slew2, vpwr, area
     FROM spiprof
     WHERE cell = 'dffnrq_1x'
     AND pin = 'VPWR'
     AND state = 'output_fall'
-    AND filename LIKE '%PVT1%'
+    AND corner = 'PVT1'
     ORDER BY vpwr'''
-    cursor.execute(data_query)
-    db_data = np.array(cursor.fetchall())
+    db_data = fetch(connection, data_query)
 
     extracted_data = db_data[:, [3, 4]].astype(float)
 
@@ -77,8 +85,7 @@ def area_vpwr_vary_parameters(connection):
     WHERE cell = 'dffnrq_1x'
     AND pin = 'VPWR'
     AND state = 'output_fall' '''
-    cursor.execute(parameter_query)
-    db_parameters = np.array(cursor.fetchall())
+    db_parameters = fetch(connection, parameter_query)
 
     plt.figure(figsize = (12, 7))
     # Uncomment the following to plot every combination of c2, slew1, slew2
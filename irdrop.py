@@ -2,10 +2,14 @@
 
 import argparse
 import sqlite3
+import mmap
 import os
+import random
 import re
+import time
 import matplotlib
 import numpy as np
+from querycache import get_generation, bump_generation
 
 # Set up and parse command line arguments
 parser = argparse.ArgumentParser(description='''Runs an IR drop analysis comparing
@@ -16,12 +20,42 @@ parser.add_argument('-e', '--errorfile', type=str, default='./error.log', help='
 parser.add_argument('-d', '--database', type=str, default='./redhawk.db', help='File path for the database')
 parser.add_argument('--is_verbose', default=False)
 parser.add_argument('--verbose', dest='is_verbose', action='store_true', help='Shows samples of each database')
+parser.add_argument('--sample', type=int, default=0, help='''Smoke QA: only check this many randomly chosen
+    pgarc cells, skipping the rest of every view file''')
+parser.add_argument('--seed', type=int, default=0, help='Random seed used to choose the --sample cells')
+parser.add_argument('--escalate', default=False, action='store_true', help='Rerun on every cell if the --sample run finds errors')
+parser.add_argument('--watch', default=False, action='store_true', help='''Keep running, and re-check each view file
+    and update the error file whenever a view file is rewritten''')
+parser.add_argument('--interval', type=float, default=1.0, help='Seconds between file checks in --watch mode')
+parser.add_argument('--charge_ratio', type=float, nargs=2, default=[0.01, 100.0], metavar=('MIN', 'MAX'),
+    help='Allowed range of spiprof switching charge (area) divided by cdev esc x VPWR')
+parser.add_argument('--pulse_ratio', type=float, nargs=2, default=[0.5, 4.0], metavar=('MIN', 'MAX'),
+    help='Allowed range of spiprof peak x width / area (1 for a square pulse, 2 for a triangle)')
+parser.add_argument('--sweep_noise', type=float, default=1e-3, help='''Relative change between VPWR sweep points
+    treated as flat by the monotonicity check. Views are printed with 5-6 significant digits, so
+    smaller changes are rounding noise''')
+parser.add_argument('--parse_only', default=False, action='store_true', help='Only build the database, skip the QA checks')
+parser.add_argument('--shards', type=str, nargs='+', help='''Build the database by merging these databases made
+    with --parse_only instead of parsing the input files''')
 args = parser.parse_args()
 
-# Load the list of files
+# Load the list of files. Each line holds a file path, optionally followed by the name of
+# the PVT corner it was characterized at and the name of its process corner (otherwise
+# both are taken from the filename)
 with open(args.input_file) as f:
-    files = f.readlines()
-files = [file.strip() for file in files]
+    lines = f.readlines()
+files = []
+declared_corners = {}
+declared_processes = {}
+for line in lines:
+    words = line.split()
+    if len(words) == 0:
+        continue
+    files.append(words[0])
+    if len(words) > 1:
+        declared_corners[words[0]] = words[1]
+    if len(words) > 2:
+        declared_processes[words[0]] = words[2]
 
 # Establish what the units for each cdev variable should be
 CDEV_UNITS = {
@@ -44,13 +78,50 @@ SPIPROF_UNITS = {
     'width': 'S'
 }
 
+# PVT corner names embedded in view filenames, ex: scf45rt_PVT1.cdev
+CORNER_PATTERN = re.compile(r'PVT\d+', re.IGNORECASE)
+
+# Process corner names start with one of these, ex: the "ssplv" in scf45rt_ssplv_1p62lv1_n40c.lib
+PROCESS_PREFIXES = ('tt', 'ss', 'ff', 'sf', 'fs')
+
+# Allowed relative slack before a cross-corner ordering is reported as implausible
+CORNER_TOLERANCE = 0.05
+
+# Matches one "<name> = <value> <unit>" spiprof parameter, ex: "C2 = 1e-15 F"
+SPIPROF_PARAMETER_PATTERN = re.compile(r'([^\s=;]+)\s*=\s*(\S+)\s+([^\s;]+)')
+
+# Spiprof data row layouts, built once per distinct data label header
+spiprof_row_layouts = {}
+
+# Start of each cell in a view file, the first group being the cell name. Used to seek to
+# sampled cells without parsing the rest of the file
+CDEV_CELL_PATTERN = re.compile(rb'Info: cell=([^\r\n]*)')
+SPIPROF_CELL_PATTERN = re.compile(rb'cell: (\S+)')
+LIB_CELL_PATTERN = re.compile(rb'[^_]cell \(\s*"?([^")\s]+)')
+
+# Names of the cells checked by a --sample run, None when every cell is checked
+sample_cells = None
+
 SEQUENTIAL_CELL_NAME_COMPONENTS = [
     "dff",
     "sdff",
     "latch",
 ]
 
-error_list = []
+# Spiprof values checked for smooth, monotonic behavior across the VPWR sweep
+SWEEP_METRICS = ['peak', 'area', 'width']
+
+# Largest allowed relative distance of a sweep point from the line through its VPWR neighbours
+SWEEP_SMOOTHNESS_TOLERANCE = 0.25
+
+# Largest allowed relative distance of a local peak/dip from its neighbouring slew/load points
+SWEEP_OUTLIER_TOLERANCE = 0.5
+
+# Shared start of every sweep error message, filled from one spiprof row
+SWEEP_DESCRIPTION = 'File: {file}: Cell {cell} pin {pin} state {state} vector {vector} (c1 = {c1} F, r = {r} Ohm, c2 = {c2} F, slew1 = {slew1} S, slew2 = {slew2} S)'
+
+# Error messages in the order they were found. A dict keeps them unique with constant time lookups
+error_messages = {}
 
 ################################################################################
 # Database creation
@@ -63,14 +134,14 @@ def create_tables(connection):
     cursor.execute('''
     CREATE TABLE cdev
     (cell, temperature, state, vector, active_input, active_output,
-    vpwr, vgnd, pin, esc, esr, leak, filename)
+    vpwr, vgnd, pin, esc, esr, leak, filename, corner, process)
     ''')
 
     # Create spiprof table
     cursor.execute('''
     CREATE TABLE spiprof
     (cell, vpwr, c1, r, c2, slew1, slew2, state, vector, active_input, active_output,
-    pin, peak, area, width, filename)
+    pin, peak, area, width, filename, corner, process)
     ''')
 
     # Create pgarc table
@@ -82,12 +153,60 @@ def create_tables(connection):
     # Create liberty file table
     cursor.execute('''
     CREATE TABLE lib
-    (cell, area, filename)
+    (cell, area, filename, corner, process)
     ''')
 
     # Save changes
     connection.commit()
 
+def merge_shards(connection, shards):
+    '''
+    Summary: copies every table row of databases built by separate --parse_only runs into
+        one database
+    Input:
+        connection: sqllite connection object of the merged database
+        shards: list of database file paths
+    '''
+    for shard in shards:
+        print("Merging: " + shard, flush=True)
+        connection.execute('ATTACH DATABASE ? AS shard', (shard,))
+        for table in ['cdev', 'spiprof', 'pgarc', 'lib']:
+            connection.execute('INSERT INTO {table} SELECT * FROM shard.{table}'.format(table = table))
+        connection.commit()
+        connection.execute('DETACH DATABASE shard')
+
+def get_corner(filename):
+    '''
+    Summary: finds the PVT corner a view file belongs to
+    Input:
+        filename: path of the view file
+    Returns: corner declared for the file in the input list, else the PVT name in the
+        filename, else the filename without its directory and extension
+    '''
+    if filename in declared_corners:
+        return declared_corners[filename]
+    basename = os.path.basename(filename)
+    match = CORNER_PATTERN.search(basename)
+    if match:
+        return match.group(0).upper()
+    return os.path.splitext(basename)[0]
+
+def get_process(filename):
+    '''
+    Summary: finds the process corner a view file was characterized at
+    Input:
+        filename: path of the view file
+    Returns: process declared for the file in the input list, else the first word of the
+        filename (after the library name) that starts like a process corner, else '' (unknown)
+    '''
+    if filename in declared_processes:
+        return declared_processes[filename]
+    words = os.path.splitext(os.path.basename(filename))[0].lower().split('_')
+    for word in words[1:]:
+        if word.startswith(PROCESS_PREFIXES):
+            return word
+    return ''
+
 
 ################################################################################
 # Error checking
@@ -99,8 +218,8 @@ def error(message):
         message: string of the error message
     '''
     new_error = 'ERROR: ' + message
-    if new_error not in error_list:
-        error_list.append(new_error)
+    if new_error not in error_messages:
+        error_messages[new_error] = None
 
 def output_errors(filename):
     '''
@@ -108,12 +227,15 @@ def output_errors(filename):
     Input:
         filename: path of the error file
     '''
-    if (len(error_list) == 0):
+    if (len(error_messages) == 0):
         print('No errors found.')
+        # Don't leave errors from an earlier run behind
+        if os.path.isfile(filename):
+            os.remove(filename)
     else:
         print('Errors found. Please refer to ' + filename)
         with open(filename, 'w') as error_file:
-            for error in error_list:
+            for error in error_messages:
                 error_file.write(error + '\n')
 
 def compare_pin_names(connection):
@@ -210,15 +332,408 @@ def check_voltage_variations(connection):
                     message = 'File: {file}: Voltage {voltage} expected in cell {cell} but not found'.format(file = file_name, voltage = voltage, cell = cell_name)
                     error(message)
 
+def group_rows(key_columns, sort_columns):
+    '''
+    Summary: orders rows so that rows with identical keys are contiguous and sorted by the
+        sort columns, then labels each contiguous group
+    Input:
+        key_columns: list of equal length arrays that together identify a group
+        sort_columns: list of arrays used to order rows inside a group, most significant first
+    Returns:
+        1) Index array that puts the rows in grouped, sorted order
+        2) Group id of each row in sorted order
+    '''
+    # np.lexsort uses the last key as the primary key
+    order = np.lexsort(tuple(reversed(list(key_columns) + list(sort_columns))))
+    new_group = np.ones(len(order), dtype=bool)
+    if len(order) > 1:
+        same_group = np.ones(len(order) - 1, dtype=bool)
+        for column in key_columns:
+            sorted_column = column[order]
+            same_group &= sorted_column[1:] == sorted_column[:-1]
+        new_group[1:] = ~same_group
+    return order, np.cumsum(new_group) - 1
+
+def interior_points(group_ids):
+    '''
+    Summary: finds the points that have a neighbour on both sides within their own group
+    Input:
+        group_ids: group id of each row in sorted order
+    Returns: boolean mask over rows 1..n-2 of the sorted order
+    '''
+    return (group_ids[1:-1] == group_ids[:-2]) & (group_ids[1:-1] == group_ids[2:])
+
+def check_sweep_curves(connection):
+    '''
+    Summary: checks that peak, area and width of every spiprof group vary monotonically and
+        smoothly across the VPWR sweep, and that no point is an outlier against its
+        neighbouring slew/load points. All groups are checked at once with array operations,
+        and each failing group/metric is reported once, naming its worst point.
+    Input:
+        connection: sqllite connection object
+    '''
+    sweep_data = fetch_table(connection, '''SELECT cell, filename, state, vector, pin, c1, r, c2, slew1, slew2, vpwr, peak, area, width FROM spiprof''')
+    if len(sweep_data) < 3:
+        return
+
+    names = sweep_data[:, :5].astype(str)
+    values = sweep_data[:, 5:].astype(float)
+    metrics = np.absolute(values[:, 6:]) # Current sign depends on the pin, compare magnitudes
+    c1, r, c2, slew1, slew2, vpwr = [values[:, i] for i in range(6)]
+    columns = {
+        'cell': names[:, 0], 'file': names[:, 1], 'state': names[:, 2], 'vector': names[:, 3], 'pin': names[:, 4],
+        'c1': c1, 'r': r, 'c2': c2, 'slew1': slew1, 'slew2': slew2, 'vpwr': vpwr,
+    }
+
+    # Replace each text column with integer codes so it can be sorted and compared cheaply
+    name_codes = [encode(names[:, i])[1] for i in range(names.shape[1])]
+
+    ############################################################################
+    # VPWR sweep: one group per cell, corner, state, pin and slew/load point
+    ############################################################################
+    order, group_ids = group_rows(name_codes + [c1, r, c2, slew1, slew2], [vpwr])
+    sorted_vpwr = vpwr[order]
+    sorted_metrics = metrics[order]
+    same_group = group_ids[1:] == group_ids[:-1]
+    group_count = group_ids[-1] + 1
+    row_groups = np.empty(len(order), dtype=int)
+    row_groups[order] = group_ids
+
+    # Monotonicity: a group may only rise or only fall, never both
+    steps = sorted_metrics[1:] - sorted_metrics[:-1]
+    step_scale = np.maximum(np.absolute(sorted_metrics[1:]), np.absolute(sorted_metrics[:-1]))
+    significant = (np.absolute(steps) > args.sweep_noise * step_scale) & same_group[:, None]
+    first_rows = order[np.searchsorted(group_ids, np.arange(group_count))]
+    message = SWEEP_DESCRIPTION + ': {metric} is not monotonic across the VPWR sweep'
+    for metric_index, metric in enumerate(SWEEP_METRICS):
+        rises = np.bincount(group_ids[1:], weights = (significant[:, metric_index] & (steps[:, metric_index] > 0)).astype(float), minlength = group_count)
+        falls = np.bincount(group_ids[1:], weights = (significant[:, metric_index] & (steps[:, metric_index] < 0)).astype(float), minlength = group_count)
+        for row in first_rows[np.nonzero((rises > 0) & (falls > 0))[0]]:
+            error(message.format(metric = metric, **{name: column[row] for name, column in columns.items()}))
+
+    # Smoothness: each interior point should lie close to the line through its VPWR neighbours
+    interior = interior_points(group_ids)
+    x_previous, x_current, x_next = sorted_vpwr[:-2], sorted_vpwr[1:-1], sorted_vpwr[2:]
+    y_previous, y_current, y_next = sorted_metrics[:-2], sorted_metrics[1:-1], sorted_metrics[2:]
+    span = x_next - x_previous
+    interior &= span > 0
+    fraction = np.divide(x_current - x_previous, span, out = np.zeros_like(span), where = span > 0)
+    expected = y_previous + (y_next - y_previous) * fraction[:, None]
+    scale = np.maximum(np.maximum(y_previous, y_current), y_next)
+    deviation = np.divide(np.absolute(y_current - expected), scale, out = np.zeros_like(scale), where = scale > 0)
+    rough = (deviation > SWEEP_SMOOTHNESS_TOLERANCE) & interior[:, None]
+
+    # Move the results from sorted positions back to original rows
+    row_deviation = np.zeros(metrics.shape)
+    row_rough = np.zeros(metrics.shape, dtype=bool)
+    row_deviation[order[1:-1]] = deviation
+    row_rough[order[1:-1]] = rough
+    message = SWEEP_DESCRIPTION + ': {metric} is not smooth across the VPWR sweep in {count} points, worst at VPWR = {vpwr} V'
+    for metric_index, metric in enumerate(SWEEP_METRICS):
+        report_worst(np.nonzero(row_rough[:, metric_index])[0], row_deviation[:, metric_index], row_groups, message, columns,
+            metric = metric)
+
+    ############################################################################
+    # Slew/load neighbours: at a fixed VPWR, compare each point to the points on
+    # either side of it along the load axis and along the slew axis
+    ############################################################################
+    # R shields c2 from the driver, so points of different R don't lie on one load axis
+    load = c1 + c2
+    axes = [
+        ('load', [vpwr, r, slew1, slew2], [load]),
+        ('slew', [vpwr, c1, r, c2], [slew1, slew2]),
+    ]
+    message = SWEEP_DESCRIPTION + ': {metric} has {count} outliers against their neighbouring {axis} points, worst at VPWR = {vpwr} V'
+    for axis_name, fixed_columns, axis_columns in axes:
+        order, group_ids = group_rows(name_codes + fixed_columns, axis_columns)
+        sorted_metrics = metrics[order]
+        interior = interior_points(group_ids)
+        y_previous, y_current, y_next = sorted_metrics[:-2], sorted_metrics[1:-1], sorted_metrics[2:]
+
+        # Only a local peak or dip can be an outlier; monotonic trends along the axis are expected
+        extremum = (y_current - y_previous) * (y_current - y_next) > 0
+        neighbour_mean = (y_previous + y_next) / 2
+        scale = np.maximum(y_previous, y_next)
+        deviation = np.divide(np.absolute(y_current - neighbour_mean), scale, out = np.zeros_like(scale), where = scale > 0)
+        outlier = (deviation > SWEEP_OUTLIER_TOLERANCE) & extremum & interior[:, None]
+
+        # Outliers are reported per VPWR sweep group, like the smoothness check
+        row_deviation = np.zeros(metrics.shape)
+        row_outlier = np.zeros(metrics.shape, dtype=bool)
+        row_deviation[order[1:-1]] = deviation
+        row_outlier[order[1:-1]] = outlier
+        for metric_index, metric in enumerate(SWEEP_METRICS):
+            report_worst(np.nonzero(row_outlier[:, metric_index])[0], row_deviation[:, metric_index], row_groups, message, columns,
+                metric = metric, axis = axis_name)
+
+def fetch_table(connection, query):
+    '''
+    Summary: runs a query and returns every result row as a 2D object array, keeping the
+        column count even when no rows are returned
+    Input:
+        connection: sqllite connection object
+        query: SQL query string
+    Returns: numpy object array of shape (rows, columns)
+    '''
+    cursor = connection.execute(query)
+    rows = cursor.fetchall()
+    if len(rows) == 0:
+        return np.empty((0, len(cursor.description)), dtype=object)
+    return np.array(rows, dtype=object)
+
+def encode(column):
+    '''
+    Summary: replaces each value of a column with an integer code, equal values sharing a code
+    Input:
+        column: 1D array
+    Returns:
+        1) Sorted array of the distinct values
+        2) Integer code of each value, indexing into the distinct values
+    '''
+    distinct, codes = np.unique(column, return_inverse=True)
+    return distinct, codes.ravel()
+
+def encode_rows(columns):
+    '''
+    Summary: numbers the distinct rows of several columns, equal rows sharing a number
+    Input:
+        columns: list of equal length integer arrays, ex: codes returned by encode
+    Returns: integer code of each row
+    '''
+    if len(columns[0]) == 0:
+        return np.zeros(0, dtype=int)
+    return np.unique(np.stack(columns, axis = 1), axis = 0, return_inverse = True)[1].ravel()
+
+def align_corners(key_columns, corner_codes, corner_count, value_columns):
+    '''
+    Summary: lines up the same point across corners so corners can be compared column to
+        column. Rows with identical keys become one row of a (point x corner) matrix.
+    Input:
+        key_columns: list of equal length arrays that identify a point independent of corner
+        corner_codes: integer corner index of each row
+        corner_count: number of distinct corners
+        value_columns: list of float arrays to align
+    Returns:
+        1) Index of one source row for each aligned point
+        2) List of (point x corner) float matrices, NaN where a corner has no data for a point
+    '''
+    order, group_ids = group_rows(key_columns, [corner_codes])
+    point_count = group_ids[-1] + 1 if len(group_ids) > 0 else 0
+    point_rows = order[np.searchsorted(group_ids, np.arange(point_count))]
+    aligned = []
+    for column in value_columns:
+        matrix = np.full((point_count, corner_count), np.nan)
+        matrix[group_ids, corner_codes[order]] = column[order]
+        aligned.append(matrix)
+    return point_rows, aligned
+
+def check_corner_consistency(connection):
+    '''
+    Summary: aligns the same cell/pin/state/parameter point across all PVT corners and flags
+        physically implausible orderings between every pair of corners:
+            - cdev leakage must not drop when temperature rises and VPWR does not drop
+            - spiprof peak current must not drop when VPWR rises and temperature does not rise
+        Process shifts both orderings, so only corners of the same process are compared. Corners
+        whose process is unknown are compared with each other. Each failing cell/pin/state/vector
+        is reported once per pair of corners, naming its worst point.
+    Input:
+        connection: sqllite connection object
+    '''
+    cdev_data = fetch_table(connection, '''SELECT cell, pin, state, vector, corner, temperature, vpwr, leak, process FROM cdev''')
+    spiprof_data = fetch_table(connection, '''SELECT cell, pin, state, vector, corner, c1, r, c2, slew1, slew2, vpwr, peak, process FROM spiprof''')
+
+    # Both views share one numbering of (corner, process) so spiprof corners can borrow cdev temperatures
+    corner_processes = np.concatenate([cdev_data[:, [4, 8]], spiprof_data[:, [4, 12]]]).astype(str)
+    corner_keys, corner_codes = encode(np.char.add(np.char.add(corner_processes[:, 0], '\t'), corner_processes[:, 1]))
+    corner_names = [key.split('\t')[0] for key in corner_keys]
+    processes = [key.split('\t')[1] for key in corner_keys]
+    corner_count = len(corner_keys)
+    cdev_corners = corner_codes[:len(cdev_data)]
+    spiprof_corners = corner_codes[len(cdev_data):]
+    corner_pairs = [(a, b) for a in range(corner_count) for b in range(corner_count)
+        if a != b and processes[a] == processes[b]]
+
+    # Say so when a corner has no partner, otherwise a skipped comparison looks like a pass
+    paired_corners = set(a for a, b in corner_pairs)
+    for corner in range(corner_count):
+        if corner_count > 1 and corner not in paired_corners:
+            print('WARNING: corner {corner} ({process}) shares its process with no other corner and is not compared across corners'.format(
+                corner = corner_names[corner], process = processes[corner] or 'unknown process'), flush=True)
+
+    # Average characterization temperature of each corner, NaN for corners without cdev data
+    cdev_temperature = cdev_data[:, 5].astype(float)
+    temperature_count = np.bincount(cdev_corners, minlength = corner_count)
+    temperature_sum = np.bincount(cdev_corners, weights = cdev_temperature, minlength = corner_count)
+    corner_temperature = np.divide(temperature_sum, temperature_count, out = np.full(corner_count, np.nan), where = temperature_count > 0)
+
+    ############################################################################
+    # cdev: leakage vs temperature
+    ############################################################################
+    if len(cdev_data) > 0:
+        names = cdev_data[:, :4].astype(str)
+        name_codes = [encode(names[:, i])[1] for i in range(names.shape[1])]
+        point_rows, (temperature, vpwr, leak) = align_corners(name_codes, cdev_corners, corner_count,
+            [cdev_temperature, cdev_data[:, 6].astype(float), cdev_data[:, 7].astype(float)])
+        point_names = names[point_rows]
+        point_groups = encode_rows([codes[point_rows] for codes in name_codes])
+        columns = {'cell': point_names[:, 0], 'pin': point_names[:, 1], 'state': point_names[:, 2], 'vector': point_names[:, 3]}
+        message = 'Cell {cell} pin {pin} state {state} vector {vector}: leak at {corner_a} is lower than at {corner_b} in {count} points, worst {leak_a} A < {leak_b} A ({temperature_a} C, {vpwr_a} V vs {temperature_b} C, {vpwr_b} V)'
+        for a, b in corner_pairs:
+            expected_higher = (temperature[:, a] > temperature[:, b]) & (vpwr[:, a] >= vpwr[:, b])
+            implausible = expected_higher & (leak[:, a] < leak[:, b] * (1 - CORNER_TOLERANCE))
+            shortfall = np.divide(leak[:, b] - leak[:, a], np.absolute(leak[:, b]), out = np.zeros(len(point_rows)), where = leak[:, b] != 0)
+            report_worst(np.nonzero(implausible)[0], shortfall, point_groups, message,
+                dict(columns, temperature_a = temperature[:, a], vpwr_a = vpwr[:, a], leak_a = leak[:, a],
+                    temperature_b = temperature[:, b], vpwr_b = vpwr[:, b], leak_b = leak[:, b]),
+                corner_a = corner_names[a], corner_b = corner_names[b])
+
+    ############################################################################
+    # spiprof: peak current vs VPWR. Corners have different nominal voltages, so
+    # sweep points are aligned by their position in the VPWR sweep
+    ############################################################################
+    if len(spiprof_data) > 0:
+        names = spiprof_data[:, :4].astype(str)
+        parameters = spiprof_data[:, 5:10].astype(float)
+        spiprof_vpwr = spiprof_data[:, 10].astype(float)
+        peak_magnitude = np.absolute(spiprof_data[:, 11].astype(float))
+        name_codes = [encode(names[:, i])[1] for i in range(names.shape[1])]
+        parameter_columns = [parameters[:, i] for i in range(parameters.shape[1])]
+
+        # Position of each row inside its own corner's VPWR sweep
+        order, group_ids = group_rows(name_codes + [spiprof_corners] + parameter_columns, [spiprof_vpwr])
+        sweep_index = np.empty(len(order), dtype=int)
+        sweep_index[order] = np.arange(len(order)) - np.searchsorted(group_ids, group_ids)
+
+        point_rows, (vpwr, peak) = align_corners(name_codes + parameter_columns + [sweep_index], spiprof_corners, corner_count,
+            [spiprof_vpwr, peak_magnitude])
+        point_names = names[point_rows]
+        point_parameters = parameters[point_rows]
+        point_groups = encode_rows([codes[point_rows] for codes in name_codes])
+        columns = {
+            'cell': point_names[:, 0], 'pin': point_names[:, 1], 'state': point_names[:, 2], 'vector': point_names[:, 3],
+            'c1': point_parameters[:, 0], 'r': point_parameters[:, 1], 'c2': point_parameters[:, 2],
+            'slew1': point_parameters[:, 3], 'slew2': point_parameters[:, 4],
+        }
+        message = 'Cell {cell} pin {pin} state {state} vector {vector}: peak at {corner_a} is lower than at {corner_b} in {count} points, worst {peak_a} A < {peak_b} A ({vpwr_a} V, {temperature_a} C vs {vpwr_b} V, {temperature_b} C; c1 = {c1} F, r = {r} Ohm, c2 = {c2} F, slew1 = {slew1} S, slew2 = {slew2} S)'
+        for a, b in corner_pairs:
+            expected_higher = (vpwr[:, a] > vpwr[:, b]) & (corner_temperature[a] <= corner_temperature[b])
+            implausible = expected_higher & (peak[:, a] < peak[:, b] * (1 - CORNER_TOLERANCE))
+            shortfall = np.divide(peak[:, b] - peak[:, a], peak[:, b], out = np.zeros(len(point_rows)), where = peak[:, b] > 0)
+            report_worst(np.nonzero(implausible)[0], shortfall, point_groups, message,
+                dict(columns, vpwr_a = vpwr[:, a], peak_a = peak[:, a], vpwr_b = vpwr[:, b], peak_b = peak[:, b]),
+                corner_a = corner_names[a], corner_b = corner_names[b],
+                temperature_a = corner_temperature[a], temperature_b = corner_temperature[b])
+
+def report_worst(rows, severity, group_ids, message, columns, **constants):
+    '''
+    Summary: reports one error per group for rows that failed a check, naming the worst row
+        and how many rows of the group failed
+    Input:
+        rows: indices of the failing rows
+        severity: how badly every row failed, larger is worse
+        group_ids: integer group id of every row
+        message: error message format string, filled with the columns plus {count}
+        columns: dictionary in format <format field> : <array with a value for every row>
+        constants: format fields that are the same for every row
+    '''
+    if len(rows) == 0:
+        return
+    rows = rows[np.argsort(-severity[rows], kind='stable')]
+    groups, first, counts = np.unique(group_ids[rows], return_index=True, return_counts=True)
+    for row, count in zip(rows[first], counts):
+        fields = {name: column[row] for name, column in columns.items()}
+        error(message.format(count = count, **constants, **fields))
+
+def check_charge_consistency(connection):
+    '''
+    Summary: joins cdev and spiprof rows of the same cell, pin, vector and corner and checks
+        the electrical values of the two views against each other in bulk:
+            - switching charge (area) at the nominal VPWR vs the cdev esc x VPWR
+            - peak x width vs area, which is fixed by the current pulse shape
+        The allowed ranges come from --charge_ratio and --pulse_ratio.
+    Input:
+        connection: sqllite connection object
+    '''
+    cdev_data = fetch_table(connection, '''SELECT cell, pin, vector, corner, vpwr, esc FROM cdev''')
+    spiprof_data = fetch_table(connection, '''SELECT cell, pin, vector, corner, state, vpwr, peak, area, width, filename FROM spiprof''')
+    if len(spiprof_data) == 0:
+        return
+
+    spiprof_names = np.char.strip(spiprof_data[:, [0, 1, 2, 3, 4, 9]].astype(str))
+    spiprof_vpwr = spiprof_data[:, 5].astype(float)
+    peak, area, width = [np.absolute(spiprof_data[:, i].astype(float)) for i in (6, 7, 8)]
+
+    # Join both views on (cell, pin, vector, corner), numbering each distinct key
+    key_names = np.char.strip(np.concatenate([cdev_data[:, :4], spiprof_data[:, :4]]).astype(str))
+    key_codes = np.stack([encode(key_names[:, i])[1] for i in range(4)], axis = 1)
+    key_count = 0
+    key_ids = np.zeros(len(key_names), dtype=int)
+    if len(key_names) > 0:
+        unique_keys, key_ids = np.unique(key_codes, axis = 0, return_inverse = True)
+        key_ids = key_ids.ravel()
+        key_count = len(unique_keys)
+    cdev_keys = key_ids[:len(cdev_data)]
+    spiprof_keys = key_ids[len(cdev_data):]
+
+    # Group failures of a (cell, pin, vector, corner) key by spiprof state for reporting
+    state_names, state_codes = encode(spiprof_names[:, 4])
+    report_ids = spiprof_keys * len(state_names) + state_codes
+    report_columns = {
+        'file': spiprof_names[:, 5],
+        'cell': spiprof_names[:, 0],
+        'pin': spiprof_names[:, 1],
+        'vector': spiprof_names[:, 2],
+        'corner': spiprof_names[:, 3],
+        'state': spiprof_names[:, 4],
+        'peak': peak,
+        'area': area,
+        'width': width,
+    }
+    description = 'File: {file}: Cell {cell} pin {pin} state {state} vector {vector} ({corner}): '
+
+    ############################################################################
+    # Switching charge vs esc x VPWR at the nominal VPWR of the cdev view
+    ############################################################################
+    cdev_rows = np.bincount(cdev_keys, minlength = key_count)
+    esc = np.divide(np.bincount(cdev_keys, weights = cdev_data[:, 5].astype(float), minlength = key_count), cdev_rows,
+        out = np.full(key_count, np.nan), where = cdev_rows > 0)
+    nominal_vpwr = np.divide(np.bincount(cdev_keys, weights = cdev_data[:, 4].astype(float), minlength = key_count), cdev_rows,
+        out = np.full(key_count, np.nan), where = cdev_rows > 0)
+
+    row_esc = esc[spiprof_keys]
+    row_nominal_vpwr = nominal_vpwr[spiprof_keys]
+    at_nominal = (cdev_rows[spiprof_keys] > 0) & np.isclose(spiprof_vpwr, row_nominal_vpwr, rtol = 1e-3)
+    expected_charge = row_esc * row_nominal_vpwr
+    comparable = at_nominal & (expected_charge > 0) & (area > 0)
+    charge_ratio = np.divide(area, expected_charge, out = np.full(len(area), np.nan), where = comparable)
+    minimum, maximum = args.charge_ratio
+    failing = np.nonzero(comparable & ((charge_ratio < minimum) | (charge_ratio > maximum)))[0]
+    message = description + 'switching charge {area} C is {ratio:.3g} x esc x VPWR ({esc} F x {vpwr} V), outside [{minimum}, {maximum}] in {count} rows'
+    report_worst(failing, np.absolute(np.log(charge_ratio)), report_ids, message,
+        dict(report_columns, ratio = charge_ratio, esc = row_esc, vpwr = row_nominal_vpwr), minimum = minimum, maximum = maximum)
+
+    ############################################################################
+    # Peak vs area / width: area = peak x width / pulse shape factor
+    ############################################################################
+    comparable = (area > 0) & (peak > 0) & (width > 0)
+    pulse_ratio = np.divide(peak * width, area, out = np.full(len(area), np.nan), where = comparable)
+    minimum, maximum = args.pulse_ratio
+    failing = np.nonzero(comparable & ((pulse_ratio < minimum) | (pulse_ratio > maximum)))[0]
+    message = description + 'peak x width / area is {ratio:.3g} ({peak} A x {width} S / {area} C), outside [{minimum}, {maximum}] in {count} rows'
+    report_worst(failing, np.absolute(np.log(pulse_ratio)), report_ids, message, dict(report_columns, ratio = pulse_ratio),
+        minimum = minimum, maximum = maximum)
+
 ################################################################################
 # .cdev Parsing
 ################################################################################
-def insert_cdev(filename, connection):
+def insert_cdev(filename, connection, corner, process):
     '''
     Summary: takes a cdev file, parses it, and inserts it into the cdev database table
     Input:
         filename: filename of the cdev file to be inserted
         connection: sqllite connection object
+        corner: PVT corner name of the file
+        process: process corner name of the file, '' if unknown
     '''
     # Parse the cdev file into JSON format
     cells = parse_cdev(filename)
@@ -229,11 +744,11 @@ def insert_cdev(filename, connection):
         for parameters in parameters_variations.values():
             for pin, pin_data in parameters['pins'].items():
                 query = '''INSERT INTO cdev VALUES ("{cell}", {temperature}, "{state}", "{vector}", "{active_input}",
-                    "{active_output}", {vpwr}, {vgnd}, "{pin}", {esc}, {esr}, {leak}, "{filename}")'''.format(cell=cell,
+                    "{active_output}", {vpwr}, {vgnd}, "{pin}", {esc}, {esr}, {leak}, "{filename}", "{corner}", "{process}")'''.format(cell=cell,
                     temperature=parameters['Temperature'], state=parameters['State'], vector=parameters['vector'],
                     active_input=parameters['active_input'], active_output=parameters['active_output'],
                     vpwr=parameters['VPWR'], vgnd=parameters['VGND'], pin=pin, esc=pin_data['esc'], esr=pin_data['esr'],
-                    leak=pin_data['leak'], filename=filename)
+                    leak=pin_data['leak'], filename=filename, corner=corner, process=process)
                 cursor = connection.cursor()
                 cursor.execute(query)
 
@@ -247,13 +762,13 @@ def parse_cdev(filename):
     Returns: dictionary of all cells in format <cell name> : {<sub_cells>}
     '''
     # First, split up cdev file into a list of text segments for each individual cell
-    with open(filename,'r') as f:
-        data = f.read()
+    data = read_view(filename, CDEV_CELL_PATTERN)
     cells = data.split('Info: cell=')
     cells.pop(0) # First element of the split is just the header info, delete it
 
     # Last cell also contains the final printed info line for the file, remove it
-    cells[-1] = '\n'.join(cells[-1].splitlines()[:-1])
+    if len(cells) > 0:
+        cells[-1] = '\n'.join(cells[-1].splitlines()[:-1])
 
     # Parse info from each cell and add it to the result cell dictionary
     cell_dict = {} # Result dictionary
@@ -365,24 +880,26 @@ def parse_cdev_parameter(parameter_string, cell_name, pin_dict={}):
     # Check to make sure it is a valid unit
     if has_unit:
         try:
-            # Try casting the variable data as a float if possible and verify the unit
+            # Try casting the variable data as a float if possible
             value = float(data[0])
-            unit = data[1]
-            if variable in CDEV_UNITS:
-                if unit != CDEV_UNITS[variable]:
-                    message = "Unknown unit '{}' for variable '{}' in cdev cell: {}".format(unit, variable, cell_name)
-                    error(message)
-            else:
-                # Variable could be a pin, if not then it's unknown
-                if variable not in pin_dict:
-                    message = "Unknown variable '{}' for cdev cell: {}".format(variable, cell_name)
-                    error(message)
-            return variable, value
-        except:
+        except ValueError:
             # data[0] does not appear to be a float, this must be some variable we
             # haven't seen before, rejoin the variable data and return it as a string
             return variable, ' '.join(data)
 
+        # Verify the unit
+        unit = data[1]
+        if variable in CDEV_UNITS:
+            if unit != CDEV_UNITS[variable]:
+                message = "Unknown unit '{}' for variable '{}' in cdev cell: {}".format(unit, variable, cell_name)
+                error(message)
+        else:
+            # Variable could be a pin, if not then it's unknown
+            if variable not in pin_dict:
+                message = "Unknown variable '{}' for cdev cell: {}".format(variable, cell_name)
+                error(message)
+        return variable, value
+
     # There does not appear to be a unit, treat the value as a string
     value = parameter_string.split('=')[1].strip()
     return variable, value
@@ -392,6 +909,24 @@ def parse_cdev_parameter(parameter_string, cell_name, pin_dict={}):
 ################################################################################
 
 def parse_pgarc(filename, connection):
+    '''
+    Summary: splits up and extracts information (pin names) for each pgarc cell and inserts
+        the cells being checked into the database
+    Returns: dictionary of all cells in format <cell name> : [<pin name>]
+    '''
+    cell_dict = read_pgarc(filename)
+    cursor = connection.cursor()
+    for cell_name, cell_pins in cell_dict.items():
+        if sample_cells is not None and cell_name not in sample_cells:
+            continue
+        for pin in cell_pins:
+            query = "INSERT INTO pgarc VALUES (\"{cell}\", \"{pin}\")".format(cell = cell_name, pin = pin)
+            cursor.execute(query)
+
+    connection.commit()
+    return cell_dict
+
+def read_pgarc(filename):
     '''
     Summary: splits up and extracts information (pin names) for each pgarc cell
     Returns: dictionary of all cells in format <cell name> : [<pin name>]
@@ -415,36 +950,38 @@ def parse_pgarc(filename, connection):
         cell_name = cell_words[0]
         cell_pins = cell_words[1:]
         cell_dict[cell_name] = cell_pins
-        cursor = connection.cursor()
-        for pin in cell_pins:
-            query = "INSERT INTO pgarc VALUES (\"{cell}\", \"{pin}\")".format(cell = cell_name, pin = pin)
-            cursor.execute(query)
 
-    connection.commit()
     return cell_dict
 
 ################################################################################
 # .spiprof Parsing
 ################################################################################
 
-def parse_spiprof(filename, connection):
+def parse_spiprof(filename, connection, corner, process):
     '''
     Summary: splits up and extracts information for each spiprof cell
     Returns: dictionary of all cells in format <cell name> : [<pin name>]
     '''
-    # First, split up pgarc file into a list of text segments for each individual cell
-    with open(filename,'r') as f:
-        data = f.read()
-        spiprof_cells = data.split('cell: ')
-        del data
-        spiprof_cells.pop(0) # First cell in split is empty, just delete it
+    start_time = time.time()
+
+    # First, split up spiprof file into a list of text segments for each individual cell
+    data = read_view(filename, SPIPROF_CELL_PATTERN)
+    line_count = data.count('\n')
+    spiprof_cells = data.split('cell: ')
+    del data
+    spiprof_cells.pop(0) # First cell in split is empty, just delete it
 
     spiprof_cell_dict = {} # Result dictionary
     for spiprof_cell in spiprof_cells:
-        parse_spiprof_cell(spiprof_cell, connection, filename)
+        parse_spiprof_cell(spiprof_cell, connection, filename, corner, process)
         connection.commit()
 
-def parse_spiprof_cell(cell, connection, filename):
+    if args.is_verbose:
+        elapsed = time.time() - start_time
+        print('Parsed {lines} lines in {seconds:.2f} s ({rate:.0f} lines/sec)'.format(
+            lines = line_count, seconds = elapsed, rate = line_count / elapsed if elapsed > 0 else 0), flush=True)
+
+def parse_spiprof_cell(cell, connection, filename, corner, process):
     '''
     Summary: splits up a spiprof cell into subcells, each subcell consisting of one set of parameters, voltage, and data
     Calls helper functions that will add to the redhawk db
@@ -463,7 +1000,7 @@ def parse_spiprof_cell(cell, connection, filename):
             spiprof_parameters_group, spiprof_voltage_parameter = parse_spiprof_parameters(spiprof_cell_name, spiprof_sub_cell_divide[0])
 
             # Because there are mutiple entries with the same parameter hash, only create a new dictionary if one does not exist
-            parse_spiprof_sub_cell(spiprof_cell_name, spiprof_voltage_parameter, spiprof_parameters_group, spiprof_sub_cell_divide[1], connection, filename)
+            parse_spiprof_sub_cell(spiprof_cell_name, spiprof_voltage_parameter, spiprof_parameters_group, spiprof_sub_cell_divide[1], connection, filename, corner, process)
 
 
 def parse_spiprof_parameters(cell_name, parameters):
@@ -473,45 +1010,37 @@ def parse_spiprof_parameters(cell_name, parameters):
     Returns: spiprof_parameters_dict: dictionary in format: <parameter name>: <parameter value>
              spiprof_voltage_parameter: dictionary in format: <pin name> : <voltage value>
     '''
-    spiprof_parameters_raw = parameters.split(' ;')
-    spiprof_voltage = 0.0
+    spiprof_parameters_raw = SPIPROF_PARAMETER_PATTERN.findall(parameters)
     spiprof_parameters_dict = {}
 
     # Handling voltage separate than the other parameters because it has its own hash
-    voltage_parameter_list = spiprof_parameters_raw[0].split(' = ', 1)
-    voltage_name = voltage_parameter_list[0].lstrip()
-    voltage_value_list = voltage_parameter_list[1].split(' ')
-    spiprof_voltage = float(voltage_value_list[0])
-    spiprof_voltage_parameter = (voltage_name, spiprof_voltage)
-    voltage_unit = voltage_value_list[1]
-    if (voltage_unit != SPIPROF_UNITS['VPWR']):
-        error("Cell " + cell_name + " has incorrect voltage units. Expected \"" + SPIPROF_UNITS['VPWR'] + "\" but found \"" + voltage_unit + "\".")
-    spiprof_parameters_raw.pop(0)
-
-    for parameter in spiprof_parameters_raw:
-        parameter_list = parameter.split(' = ', 1)
-        parameter_name = parameter_list[0].lstrip()
-        parameter_value_list = parameter_list[1].split(' ')
-        parameter_value = float(parameter_value_list[0])
-        parameter_value_unit = parameter_value_list[1].strip()
-        if (parameter_value_unit != SPIPROF_UNITS[parameter_name]):
-            error("Cell " + cell_name + " has incorrect " + parameter_name + " units. Expected \"" + SPIPROF_UNITS[parameter_name] + "\" but found \"" + parameter_value_unit + "\".")
-        spiprof_parameters_dict[parameter_name] = parameter_value
+    voltage_name, voltage_value, voltage_unit = spiprof_parameters_raw.pop(0)
+    spiprof_voltage_parameter = (voltage_name, float(voltage_value))
+    if voltage_unit != SPIPROF_UNITS['VPWR']:
+        error('Cell {cell} has incorrect voltage units. Expected "{expected}" but found "{found}".'.format(
+            cell = cell_name, expected = SPIPROF_UNITS['VPWR'], found = voltage_unit))
+
+    for parameter_name, parameter_value, parameter_value_unit in spiprof_parameters_raw:
+        if parameter_value_unit != SPIPROF_UNITS[parameter_name]:
+            error('Cell {cell} has incorrect {name} units. Expected "{expected}" but found "{found}".'.format(
+                cell = cell_name, name = parameter_name, expected = SPIPROF_UNITS[parameter_name], found = parameter_value_unit))
+        spiprof_parameters_dict[parameter_name] = float(parameter_value)
 
     return spiprof_parameters_dict, spiprof_voltage_parameter
 
-def parse_spiprof_sub_cell(cell_name, voltage_parameter, cell_parameters, sub_cell, connection, filename):
+def parse_spiprof_sub_cell(cell_name, voltage_parameter, cell_parameters, sub_cell, connection, filename, corner, process):
     '''
     Summary: parses subcell data. Gets secondary parameters, data label names, and data
     Checks if sequential cells have 4 states, and that combinational cells have 2 states. Uses name of cell.
     Inserts cell data into the database.
     '''
+    cursor = connection.cursor()
     spiprof_data_group_dict = {}
     spiprof_data_group_list = sub_cell.split('      state = ')
     spiprof_data_group_list.pop(0)
 
     isSequential = False
-    for (name_component in SEQUENTIAL_CELL_NAME_COMPONENTS):
+    for name_component in SEQUENTIAL_CELL_NAME_COMPONENTS:
         if name_component in cell_name:
             isSequential = True
     if (isSequential):
@@ -522,7 +1051,6 @@ def parse_spiprof_sub_cell(cell_name, voltage_parameter, cell_parameters, sub_ce
             error("File: " + filename + ": Cell " + cell_name + " is probably combinational, so it should have 2 states. Instead, it has " + str(len(spiprof_data_group_list)) + " states.")
 
     for data_group in spiprof_data_group_list:
-        spiprof_data_dict = {}
         spiprof_data_lines = data_group.split('\n')
 
         spiprof_data_parameters_dict = {}
@@ -547,38 +1075,105 @@ def parse_spiprof_sub_cell(cell_name, voltage_parameter, cell_parameters, sub_ce
 
         spiprof_data_lines.pop(0)
 
-        for spiprof_data_line in spiprof_data_lines:
-            if (spiprof_data_line != 'Info: Done' and spiprof_data_line != ''):
-                spiprof_data_raw = spiprof_data_line.split()
-                spiprof_pin_name = spiprof_data_raw.pop(0) # pop off pin name
-                spiprof_pin_data_dict = {}
-                label_index = 0
-                for spiprof_data_label in spiprof_data_labels:
-                    spiprof_pin_data_dict[spiprof_data_label] = float(spiprof_data_raw[label_index * 2])
-                    data_unit = spiprof_data_raw[label_index * 2 + 1]
-                    if (data_unit != SPIPROF_UNITS[spiprof_data_label]):
-                        error("Cell " + cell_name + " has incorrect " + spiprof_data_label + " units. Expected \"" + SPIPROF_UNITS[spiprof_data_label] + "\" but found \"" + data_unit + "\".")
-                    label_index = label_index + 1
-                spiprof_data_dict[spiprof_pin_name] = spiprof_pin_data_dict
-                query = "INSERT INTO spiprof VALUES (\"{cell}\", {vpwr}, {c1}, {r}, {c2}, {slew1}, {slew2}, \"{state}\", \"{vector}\", \"{active_input}\", \"{active_output}\", \"{pin}\", {peak}, {area}, {width}, \"{file}\")".format(cell=cell_name, vpwr=voltage_parameter[1], c1=cell_parameters["C1"], r=cell_parameters["R"], c2=cell_parameters["C2"], slew1=cell_parameters["Slew1"], slew2=cell_parameters["Slew2"], state=spiprof_data_parameters_dict['state'], vector=spiprof_data_parameters_dict['vector'], active_input=spiprof_data_parameters_dict['active_input'], active_output=spiprof_data_parameters_dict['active_output'], pin=spiprof_pin_name, peak=spiprof_pin_data_dict['peak'], area=spiprof_pin_data_dict['area'], width=spiprof_pin_data_dict['width'], file=filename)
-                #print(query)
-                cursor = connection.cursor()
-                cursor.execute(query)
+        # Parse every data row of the block at once and insert them together
+        spiprof_data_lines = [line for line in spiprof_data_lines if line != 'Info: Done' and line != '']
+        spiprof_pin_names, spiprof_data_values = parse_spiprof_rows(cell_name, spiprof_data_labels, spiprof_data_lines)
+        rows = [(cell_name, voltage_parameter[1], cell_parameters["C1"], cell_parameters["R"], cell_parameters["C2"],
+            cell_parameters["Slew1"], cell_parameters["Slew2"], spiprof_data_parameters_dict['state'],
+            spiprof_data_parameters_dict['vector'], spiprof_data_parameters_dict['active_input'],
+            spiprof_data_parameters_dict['active_output'], pin, peak, area, width, filename, corner, process)
+            for pin, peak, area, width in zip(spiprof_pin_names, spiprof_data_values['peak'],
+                spiprof_data_values['area'], spiprof_data_values['width'])]
+        cursor.executemany('INSERT INTO spiprof VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+def get_spiprof_row_layout(labels):
+    '''
+    Summary: returns the token layout of data rows under a header, building it the first time
+        the header is seen. A row is a pin name followed by a value and unit per label.
+    Input:
+        labels: list of data label names, ex: ['peak', 'area', 'width']
+    Returns:
+        1) Number of tokens in one row
+        2) Tuple of (label, token offset of its value, expected unit) for each label
+    '''
+    labels = tuple(labels)
+    if labels not in spiprof_row_layouts:
+        columns = tuple((label, 1 + label_index * 2, SPIPROF_UNITS[label]) for label_index, label in enumerate(labels))
+        spiprof_row_layouts[labels] = (1 + len(labels) * 2, columns)
+    return spiprof_row_layouts[labels]
+
+def parse_spiprof_rows(cell_name, labels, lines):
+    '''
+    Summary: parses all the data rows of one spiprof block in one go. The block is tokenized
+        once, units are checked once per column, and error messages are only built for
+        columns that contain a wrong unit.
+    Input:
+        cell_name: string name of the cell being parsed, used for error messages
+        labels: list of data label names
+        lines: list of data row strings
+    Returns:
+        1) Tuple of pin names, one per row
+        2) Dictionary in format <label> : <list of float values, one per row>
+    '''
+    if len(labels) == 0 or len(lines) == 0:
+        return parse_spiprof_rows_slow(cell_name, labels, lines)
+
+    stride, columns = get_spiprof_row_layout(labels)
+    tokens = '\n'.join(lines).split()
+    if len(tokens) != stride * len(lines):
+        # Some row does not fit the header, let the line by line parser handle it
+        return parse_spiprof_rows_slow(cell_name, labels, lines)
+
+    for label, offset, expected_unit in columns:
+        units = tokens[offset + 1::stride]
+        if units.count(expected_unit) != len(units):
+            for unit in sorted(set(units)):
+                if unit != expected_unit:
+                    error('Cell {cell} has incorrect {label} units. Expected "{expected}" but found "{found}".'.format(
+                        cell = cell_name, label = label, expected = expected_unit, found = unit))
+
+    # Blocks only hold a few rows, so plain float() beats building a numpy array per block
+    values = {label: list(map(float, tokens[offset::stride])) for label, offset, expected_unit in columns}
+    return tuple(tokens[0::stride]), values
+
+def parse_spiprof_rows_slow(cell_name, labels, lines):
+    '''
+    Summary: line by line fallback for parse_spiprof_rows, used when a block does not match its
+        compiled row tokenizer
+    Input:
+        cell_name: string name of the cell being parsed, used for error messages
+        labels: list of data label names
+        lines: list of data row strings
+    Returns: same as parse_spiprof_rows
+    '''
+    pin_names = []
+    values = {label: [] for label in labels}
+    for line in lines:
+        data_raw = line.split()
+        pin_names.append(data_raw.pop(0)) # pop off pin name
+        for label_index, label in enumerate(labels):
+            values[label].append(float(data_raw[label_index * 2]))
+            data_unit = data_raw[label_index * 2 + 1]
+            if data_unit != SPIPROF_UNITS[label]:
+                error('Cell {cell} has incorrect {label} units. Expected "{expected}" but found "{found}".'.format(
+                    cell = cell_name, label = label, expected = SPIPROF_UNITS[label], found = data_unit))
+    return tuple(pin_names), values
 
 ################################################################################
 # .lib Parsing
 ################################################################################
-def insert_lib(filename, connection):
+def insert_lib(filename, connection, corner, process):
     '''
     Summary: reads a liberty file, extracts the name and area of a cell, and inserts
         it into a database
     Input:
         filename: liberty filename
         connection: sqllite connection object
+        corner: PVT corner name of the file
+        process: process corner name of the file, '' if unknown
     '''
     # First, split up lib file into a list of raw text segments for each individual cell
-    with open(filename,'r') as f:
-        data = f.read()
+    data = read_view(filename, LIB_CELL_PATTERN)
     cells_raw = re.compile("[^_]cell \(").split(data)
     cells_raw.pop(0) # First index of the split is header info, throw it out
 
@@ -600,38 +1195,172 @@ def insert_lib(filename, connection):
                 break
 
         # Insert into database
-        query = 'INSERT INTO lib VALUES ("{cell}", {area}, "{filename}")'.format(cell=name, area=area, filename=filename)
+        query = 'INSERT INTO lib VALUES ("{cell}", {area}, "{filename}", "{corner}", "{process}")'.format(cell=name, area=area,
+            filename=filename, corner=corner, process=process)
         cursor = connection.cursor()
         cursor.execute(query)
 
     connection.commit() # Save database changes
 
 ################################################################################
-# Main script
+# Sampling
 ################################################################################
+def read_view(filename, cell_pattern):
+    '''
+    Summary: reads a view file. During a --sample run, seeks to just the sampled cells and
+        skips every other cell without parsing it
+    Input:
+        filename: path of the view file
+        cell_pattern: compiled bytes pattern matching the start of a cell, group 1 is the cell name
+    Returns: file text holding the header and every cell being checked
+    '''
+    if sample_cells is None:
+        with open(filename, 'r') as f:
+            return f.read()
+
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            starts = [(match.start(), match.group(1).decode().strip()) for match in cell_pattern.finditer(view)]
+            if len(starts) == 0:
+                return view[:].decode()
+
+            # Keep the header, then every sampled cell segment
+            segments = [view[:starts[0][0]]]
+            ends = [start for start, name in starts[1:]] + [len(view)]
+            for (start, name), end in zip(starts, ends):
+                if name in sample_cells:
+                    segments.append(view[start:end])
+
+            # The last cell carries the file's closing line, keep it even if that cell was skipped
+            if starts[-1][1] not in sample_cells:
+                last_segment = view[starts[-1][0]:].rstrip(b'\r\n')
+                closing_line = last_segment[last_segment.rfind(b'\n') + 1:]
+                segments = [b''.join(segments).rstrip(b'\r\n'), b'\n', closing_line, b'\n']
+
+    return b''.join(segments).decode().replace('\r\n', '\n')
+
+def choose_sample(files, sample_size, seed):
+    '''
+    Summary: picks a deterministic random subset of the cells listed in the pgarc files
+    Input:
+        files: list of view file paths
+        sample_size: number of cells to pick
+        seed: random seed, the same seed and pgarc files always give the same cells
+    Returns:
+        1) Set of sampled cell names
+        2) Total number of pgarc cells
+    '''
+    all_cells = set()
+    for file in files:
+        if file.endswith('.pgarc'):
+            all_cells.update(read_pgarc(file).keys())
+    all_cells = sorted(all_cells)
+    sampled = random.Random(seed).sample(all_cells, min(sample_size, len(all_cells)))
+    return set(sampled), len(all_cells)
+
+def defect_rate_interval(defects, sample_size, total_cells, z = 1.96):
+    '''
+    Summary: Wilson score interval of the library defect rate. Unlike the normal approximation it
+        doesn't collapse to +/- 0 when the sample has no defects, where its upper bound is close
+        to the rule of three (3 / sample size). The finite population correction narrows it as the
+        sample covers more of the library.
+    Input:
+        defects: number of defective cells in the sample
+        sample_size: number of sampled cells
+        total_cells: total number of pgarc cells
+        z: normal quantile of the confidence level, 1.96 for 95%
+    Returns: (lower bound, upper bound) of the defect rate
+    '''
+    if sample_size == 0:
+        return 0.0, 1.0
+    rate = defects / sample_size
+    correction = (total_cells - sample_size) / (total_cells - 1) if total_cells > 1 else 0
+    if correction <= 0:
+        # Every cell was checked, so the rate is exact
+        return rate, rate
+
+    # Shrinking the variance by the correction is the same as a larger effective sample
+    n = sample_size / correction
+    denominator = 1 + z * z / n
+    center = (rate + z * z / (2 * n)) / denominator
+    margin = z * (rate * (1 - rate) / n + z * z / (4 * n * n)) ** 0.5 / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+def report_sample(sampled, total_cells):
+    '''
+    Summary: prints how much of the library the sample covered and the defect rate it suggests
+    Input:
+        sampled: set of sampled cell names
+        total_cells: total number of pgarc cells
+    '''
+    # A cell is defective if any error names it
+    defective_cells = set()
+    for message in error_messages:
+        for name in re.findall(r'[Cc]ell:? (\S+)', message):
+            name = name.rstrip(':,.')
+            if name in sampled:
+                defective_cells.add(name)
+
+    sample_size = len(sampled)
+    coverage = sample_size / total_cells if total_cells > 0 else 0
+    defect_rate = len(defective_cells) / sample_size if sample_size > 0 else 0
+    lower, upper = defect_rate_interval(len(defective_cells), sample_size, total_cells)
+
+    print('Sample: {sampled} of {total} cells ({coverage:.1%} coverage)'.format(
+        sampled = sample_size, total = total_cells, coverage = coverage))
+    print('Defective cells in sample: {defective} ({rate:.1%}, 95% interval {lower:.1%} to {upper:.1%})'.format(
+        defective = len(defective_cells), rate = defect_rate, lower = lower, upper = upper))
+    print('Estimated defective cells in library: {estimate:.0f} of {total} (at most {bound:.0f} at 95% confidence)'.format(
+        estimate = defect_rate * total_cells, total = total_cells, bound = upper * total_cells), flush=True)
 
-# # Check if db already exists: if so, delete it to allow for a fresh one to be made
-if(os.path.isfile(args.database)):
-    os.remove(args.database)
-
-# Initialize database
-connection = sqlite3.connect(args.database)
-create_tables(connection)
-
-# Insert the file data into the database
-for file in files:
+################################################################################
+# Main script
+################################################################################
+def create_database(path):
+    '''
+    Summary: creates a fresh database, deleting any database already at the path
+    Input:
+        path: file path for the database
+    Returns: sqllite connection object
+    '''
+    # Check if db already exists: if so, delete it to allow for a fresh one to be made
+    previous_generation = 0
+    if(os.path.isfile(path)):
+        old_connection = sqlite3.connect(path)
+        previous_generation = get_generation(old_connection)
+        old_connection.close()
+        os.remove(path)
+
+    connection = sqlite3.connect(path)
+    create_tables(connection)
+    bump_generation(connection, previous_generation)
+    return connection
+
+def ingest_file(file, connection):
+    '''
+    Summary: parses a view file and inserts its data into the database
+    Input:
+        file: path of the view file
+        connection: sqllite connection object
+    '''
     print("Parsing: " + file, flush=True)
     if file.endswith('.cdev'):
-        insert_cdev(file, connection)
+        insert_cdev(file, connection, get_corner(file), get_process(file))
     elif file.endswith('.spiprof'):
-        parse_spiprof(file, connection)
+        parse_spiprof(file, connection, get_corner(file), get_process(file))
     elif file.endswith('.lib'):
-        insert_lib(file, connection)
+        insert_lib(file, connection, get_corner(file), get_process(file))
     elif file.endswith('.pgarc'):
         parse_pgarc(file, connection)
 
-# Print sample data if verbose is turned on
-if args.is_verbose:
+def print_database_samples(connection):
+    '''
+    Summary: prints the first rows of every table
+    Input:
+        connection: sqllite connection object
+    '''
     print('cdev sample:')
     for row in connection.execute('SELECT * FROM cdev LIMIT 10'):
         print(row)
@@ -646,10 +1375,222 @@ if args.is_verbose:
         print(row)
     print()
 
-# Run additional QA
-compare_cell_names(connection)
-check_voltage_variations(connection)
-compare_pin_names(connection)
+# Every QA check run against the database, in order
+QA_CHECKS = [
+    compare_cell_names,
+    check_voltage_variations,
+    compare_pin_names,
+    check_sweep_curves,
+    check_corner_consistency,
+    check_charge_consistency,
+]
+
+# QA checks that read data from each kind of view file
+CHECKS_BY_VIEW = {
+    '.cdev': [compare_cell_names, check_voltage_variations, compare_pin_names, check_corner_consistency, check_charge_consistency],
+    '.spiprof': [compare_cell_names, check_voltage_variations, compare_pin_names, check_sweep_curves, check_corner_consistency,
+        check_charge_consistency],
+    '.pgarc': [compare_cell_names, compare_pin_names],
+    '.lib': [],
+}
+
+# Database table holding each kind of view file
+TABLES_BY_VIEW = {
+    '.cdev': 'cdev',
+    '.spiprof': 'spiprof',
+    '.pgarc': 'pgarc',
+    '.lib': 'lib',
+}
+
+def run_checks(connection):
+    '''
+    Summary: runs every QA check against the database, adding to the error list
+    Input:
+        connection: sqllite connection object
+    '''
+    for check in QA_CHECKS:
+        check(connection)
+
+def run(connection):
+    '''
+    Summary: inserts every view file into the database and runs the QA checks
+    Input:
+        connection: sqllite connection object
+    '''
+    if args.shards:
+        merge_shards(connection, args.shards)
+    else:
+        for file in files:
+            ingest_file(file, connection)
+    bump_generation(connection, get_generation(connection))
+
+    # Print sample data if verbose is turned on
+    if args.is_verbose:
+        print_database_samples(connection)
+
+    if not args.parse_only:
+        run_checks(connection)
+
+################################################################################
+# Watch mode
+################################################################################
+def collect_errors(function, *arguments):
+    '''
+    Summary: runs a function and returns the errors it reported instead of adding them to the
+        error list. If the function raises, the exception is reported as an error too so that a
+        view caught mid-write can't stop the watch.
+    Input:
+        function: function to run
+        arguments: arguments passed to the function
+    Returns: dictionary of the error messages, in the same form as error_messages
+    '''
+    global error_messages
+    saved_errors = error_messages
+    error_messages = {}
+    try:
+        try:
+            function(*arguments)
+        except Exception as exception:
+            error('{function} could not run: {type}: {exception}'.format(
+                function = function.__name__, type = type(exception).__name__, exception = exception))
+        return error_messages
+    finally:
+        error_messages = saved_errors
+
+def get_file_state(file):
+    '''
+    Summary: returns what is needed to tell whether a file was rewritten
+    Input:
+        file: path of the file
+    Returns: tuple of (modification time, size), None if the file does not exist
+    '''
+    try:
+        stat = os.stat(file)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def delete_file_rows(file, connection):
+    '''
+    Summary: removes the database rows that came from a view file. pgarc rows don't record
+        their file, so they are left for the caller to clear all at once.
+    Input:
+        file: path of the view file
+        connection: sqllite connection object
+    '''
+    extension = os.path.splitext(file)[1]
+    if extension in TABLES_BY_VIEW and extension != '.pgarc':
+        connection.execute('DELETE FROM {table} WHERE filename = ?'.format(table = TABLES_BY_VIEW[extension]), (file,))
+    connection.commit()
+
+def reingest_file(file, connection):
+    '''
+    Summary: replaces the database rows of a view file with freshly parsed ones
+    Input:
+        file: path of the view file
+        connection: sqllite connection object
+    '''
+    delete_file_rows(file, connection)
+    try:
+        ingest_file(file, connection)
+    except Exception as exception:
+        # The file may still be half written, its next write will trigger another try
+        connection.rollback()
+        delete_file_rows(file, connection)
+        error('File: {file}: could not be parsed: {exception}'.format(file = file, exception = exception))
+
+def merge_errors(file_errors, check_errors):
+    '''
+    Summary: rebuilds the error list from the errors of every file and check, then rewrites
+        the error file
+    Input:
+        file_errors: dictionary in format <file> : <error messages>
+        check_errors: dictionary in format <check function> : <error messages>
+    '''
+    global error_messages
+    error_messages = dict.fromkeys(
+        [message for file in files for message in file_errors.get(file, [])] +
+        [message for check in QA_CHECKS for message in check_errors.get(check, [])])
+    output_errors(args.errorfile)
+
+def watch(connection):
+    '''
+    Summary: checks every view file, then keeps the database open and polls the view files.
+        When a file is rewritten, only that file is parsed again and only the QA checks that
+        read its view are run again, then the error file is rewritten.
+    Input:
+        connection: sqllite connection object
+    '''
+    # Errors reported while parsing each file and by each check, so they can be replaced separately
+    file_errors = {}
+    check_errors = {}
+
+    ingested_states = {}
+    for file in files:
+        ingested_states[file] = get_file_state(file)
+        file_errors[file] = collect_errors(reingest_file, file, connection)
+    for check in QA_CHECKS:
+        check_errors[check] = collect_errors(check, connection)
+    bump_generation(connection, get_generation(connection))
+    merge_errors(file_errors, check_errors)
+
+    print('Watching {count} files, press Ctrl+C to stop'.format(count = len(files)), flush=True)
+    previous_states = dict(ingested_states)
+    try:
+        while True:
+            time.sleep(args.interval)
+
+            # A file is ready once it has changed and then stayed the same for a whole interval
+            changed_files = []
+            for file in files:
+                state = get_file_state(file)
+                if state is not None and state != ingested_states[file] and state == previous_states[file]:
+                    changed_files.append(file)
+                previous_states[file] = state
+            if len(changed_files) == 0:
+                continue
+
+            # All pgarc rows are replaced together, so every pgarc file has to be parsed again
+            if any(file.endswith('.pgarc') for file in changed_files):
+                changed_files += [file for file in files if file.endswith('.pgarc') and file not in changed_files]
+                connection.execute('DELETE FROM pgarc')
+
+            start_time = time.time()
+            checks = set()
+            for file in changed_files:
+                ingested_states[file] = previous_states[file]
+                file_errors[file] = collect_errors(reingest_file, file, connection)
+                checks.update(CHECKS_BY_VIEW.get(os.path.splitext(file)[1], []))
+            bump_generation(connection, get_generation(connection))
+            for check in QA_CHECKS:
+                if check in checks:
+                    check_errors[check] = collect_errors(check, connection)
+            merge_errors(file_errors, check_errors)
+            print('Re-checked {count} files in {seconds:.2f} s'.format(count = len(changed_files), seconds = time.time() - start_time), flush=True)
+    except KeyboardInterrupt:
+        print('Stopped watching', flush=True)
+
+connection = create_database(args.database)
+
+if args.watch:
+    if args.sample > 0:
+        sample_cells, total_cells = choose_sample(files, args.sample, args.seed)
+    watch(connection)
+elif args.sample > 0:
+    sample_cells, total_cells = choose_sample(files, args.sample, args.seed)
+    run(connection)
+    report_sample(sample_cells, total_cells)
+
+    # Throw the sample away and check every cell
+    if args.escalate and len(error_messages) > 0:
+        print('Sample found errors, escalating to a full run', flush=True)
+        connection.close()
+        error_messages.clear()
+        sample_cells = None
+        connection = create_database(args.database)
+        run(connection)
+else:
+    run(connection)
 
 # Log errors
 output_errors(args.errorfile)
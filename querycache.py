@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+# Default size limit of a cache file, least recently used results are evicted past it
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Quoted SQL strings and identifiers, which must keep their case and spacing
+SQL_QUOTED_PATTERN = re.compile(r'''('(?:[^']|'')*'|"(?:[^"]|"")*")''')
+
+################################################################################
+# Query normalization
+################################################################################
+def normalize_query(query):
+    '''
+    Summary: rewrites a query so that spacing, keyword case and a trailing ; don't change
+        its cache key. Text inside quotes is left alone.
+    Input:
+        query: SQL query string
+    Returns: normalized query string
+    '''
+    parts = SQL_QUOTED_PATTERN.split(query.strip().rstrip(';'))
+    # Odd parts are the quoted text captured by the split
+    for index in range(0, len(parts), 2):
+        parts[index] = re.sub(r'\s+', ' ', parts[index]).lower()
+    return ''.join(parts).strip()
+
+def is_cacheable(normalized_query):
+    '''
+    Summary: only read-only queries can be cached
+    Input:
+        normalized_query: query string returned by normalize_query
+    Returns: True if the query only reads data
+    '''
+    return normalized_query.startswith('select') or normalized_query.startswith('with')
+
+def get_generation(connection):
+    '''
+    Summary: reads the database generation number, which changes on every write so that
+        cached results of older generations are never reused
+    Input:
+        connection: sqllite connection object
+    Returns: generation number
+    '''
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+def bump_generation(connection, previous_generation):
+    '''
+    Summary: moves the database to a new generation after a write. The clock is used as a
+        floor so a database that was deleted and rebuilt never reuses an old generation.
+    Input:
+        connection: sqllite connection object
+        previous_generation: generation before the write
+    '''
+    generation = max(previous_generation + 1, int(time.time()))
+    connection.execute('PRAGMA user_version = {}'.format(generation))
+    connection.commit()
+
+################################################################################
+# Cache storage
+################################################################################
+def open_cache(cache_path):
+    '''
+    Summary: opens the cache file, creating its table the first time
+    Input:
+        cache_path: file path of the cache
+    Returns: sqllite connection object of the cache
+    '''
+    cache = sqlite3.connect(cache_path)
+    cache.execute('''
+    CREATE TABLE IF NOT EXISTS results
+    (key TEXT PRIMARY KEY, database TEXT, generation INTEGER, data BLOB, size INTEGER, last_used REAL)
+    ''')
+    return cache
+
+def evict(cache, max_bytes):
+    '''
+    Summary: deletes the least recently used results until the cache fits in max_bytes
+    Input:
+        cache: sqllite connection object of the cache
+        max_bytes: size limit of all stored results
+    '''
+    total = cache.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+    if total <= max_bytes:
+        return
+    evicted = []
+    for key, size in cache.execute('SELECT key, size FROM results ORDER BY last_used'):
+        if total <= max_bytes:
+            break
+        evicted.append((key,))
+        total -= size
+    cache.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+def encode_result(names, rows):
+    '''
+    Summary: serializes a query result for the cache. JSON is used rather than pickle because the
+        cache file is shared, and unpickling a file someone else can write runs their code.
+    Input:
+        names: list of column names
+        rows: list of result rows
+    Returns: compressed bytes, or None if the result has values JSON can't store (BLOBs)
+    '''
+    try:
+        return zlib.compress(json.dumps([names, rows]).encode())
+    except TypeError:
+        return None
+
+def decode_result(data):
+    '''
+    Summary: reads back a query result stored by encode_result
+    Input:
+        data: compressed bytes from the cache
+    Returns: (list of column names, list of result rows), or None if the data can't be read
+    '''
+    try:
+        names, rows = json.loads(zlib.decompress(data).decode())
+    except (zlib.error, ValueError):
+        return None
+    return names, [tuple(row) for row in rows]
+
+def run_query(connection, query, parameters=()):
+    '''
+    Summary: runs a query without the cache. Only reads are meant to go through here, so
+        anything a statement changed is rolled back, the same as a query run and never committed.
+    Input:
+        connection: sqllite connection object of the database
+        query: SQL query string
+        parameters: query parameters
+    Returns:
+        1) List of column names
+        2) List of result rows
+    '''
+    # An explicit transaction also covers statements sqlite3 would otherwise autocommit, ex: DROP TABLE
+    if not connection.in_transaction:
+        connection.execute('BEGIN')
+    try:
+        cursor = connection.execute(query, parameters)
+        rows = cursor.fetchall()
+        names = [description[0] for description in cursor.description] if cursor.description else []
+    finally:
+        connection.rollback()
+    return names, rows
+
+def cached_query(connection, database, query, parameters=(), cache_path=None, max_bytes=DEFAULT_CACHE_BYTES):
+    '''
+    Summary: runs a query, or returns its stored result if the same query and parameters were
+        already run against the current generation of the database. Statements that write are
+        run but rolled back, and if the cache can't be opened or written (ex: a read-only
+        directory holding a released database) the query is simply run uncached.
+    Input:
+        connection: sqllite connection object of the database
+        database: file path of the database, part of the cache key
+        query: SQL query string
+        parameters: query parameters
+        cache_path: file path of the cache, defaults to the database path + '.cache'
+        max_bytes: size limit of the cache
+    Returns:
+        1) List of column names
+        2) List of result rows
+    '''
+    normalized_query = normalize_query(query)
+    if not is_cacheable(normalized_query):
+        return run_query(connection, query, parameters)
+
+    if cache_path is None:
+        cache_path = database + '.cache'
+    database = os.path.abspath(database)
+    generation = get_generation(connection)
+    key = hashlib.sha256(json.dumps([database, normalized_query, list(parameters)], default=str).encode()).hexdigest()
+
+    cache = None
+    try:
+        cache = open_cache(cache_path)
+        stored = cache.execute('SELECT generation, data FROM results WHERE key = ?', (key,)).fetchone()
+    except sqlite3.Error:
+        if cache is not None:
+            cache.close()
+        return run_query(connection, query, parameters)
+
+    try:
+        if stored is not None and stored[0] == generation:
+            result = decode_result(stored[1])
+            if result is not None:
+                try:
+                    cache.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+                    cache.commit()
+                except sqlite3.Error:
+                    pass # A read-only cache still serves its results
+                return result
+
+        names, rows = run_query(connection, query, parameters)
+        data = encode_result(names, rows)
+        if data is None:
+            return names, rows
+        try:
+            # Results of older generations of this database can never be used again
+            cache.execute('DELETE FROM results WHERE database = ? AND generation != ?', (database, generation))
+            cache.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (key, database, generation, data, len(data), time.time()))
+            evict(cache, max_bytes)
+            cache.commit()
+        except sqlite3.Error:
+            cache.rollback()
+        return names, rows
+    finally:
+        cache.close()